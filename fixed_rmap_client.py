@@ -8,19 +8,32 @@ This version includes:
 4. Fallback options for different key configurations
 """
 
-import sys, secrets, base64, json, requests
-from pathlib import Path
+import os, sys, shutil, logging, argparse, importlib, requests
+from requests.adapters import HTTPAdapter
 
 # ---- Python 3.13 imghdr shim (PGPy still imports it) ----
-if 'imghdr' not in sys.modules:  # pragma: no cover
-    import types
-    shim = types.ModuleType('imghdr')
-    def what(file, h=None):  # minimal API
-        return None
-    shim.what = what
-    sys.modules['imghdr'] = shim
+def _import_pgpy_with_imghdr_shim():
+    """Import PGPy with an imghdr shim that is removed from sys.modules afterwards.
+
+    PGPy keeps its own reference to the shim; nothing else sees it.
+    """
+    injected = None
+    if 'imghdr' not in sys.modules:  # pragma: no cover
+        import types
+        shim = types.ModuleType('imghdr')
+        def what(file, h=None):  # minimal API
+            return None
+        shim.what = what
+        injected = sys.modules.setdefault('imghdr', shim)
+    try:
+        return importlib.import_module('pgpy')
+    finally:
+        if injected is not None and sys.modules.get('imghdr') is injected:
+            del sys.modules['imghdr']
 
-from pgpy import PGPKey, PGPMessage  # after shim
+pgpy = _import_pgpy_with_imghdr_shim()
+from pgpy import PGPMessage  # already imported above
+from rmap_common import b64, json_dumps, json_loads, log, JSON_HEADERS, rand64, nonce, load_key, unlock_key
 
 # ---- CONSTANTS (edit these) ----
 IDENTITY = "Group_04"                 # Must match public key file stem on server
@@ -37,113 +50,136 @@ SERVER_PUB_KEY_CANDIDATES = [
 CLIENT_PRIV_KEY_PATH = "priv.asc"     # Client *private* key (NOT just public)
 CLIENT_PRIV_PASSPHRASE = "Grabbed-Harbor-Breathing-Growth-Jump-Ability-Never-Ask-Worth6"
 
+# One pooled session for every round trip to SERVER_BASE (keep-alive reuse)
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+
 def find_and_load_server_key():
     """Try to find and load the correct server public key."""
-    print("=== Looking for Server Public Key ===")
+    log.debug("=== Looking for Server Public Key ===")
     
     for candidate in SERVER_PUB_KEY_CANDIDATES:
-        if Path(candidate).is_file():
-            try:
-                server_pub_key, _ = PGPKey.from_file(str(candidate))
-                print(f"✓ Loaded server public key from: {candidate}")
-                print(f"  Fingerprint: {server_pub_key.fingerprint}")
-                print(f"  Algorithm: {server_pub_key.key_algorithm}")
-                print(f"  Key size: {server_pub_key.key_size}")
-                
-                # Try to get user ID info
-                if hasattr(server_pub_key, 'userids') and server_pub_key.userids:
-                    print(f"  User ID: {server_pub_key.userids[0]}")
-                
-                return server_pub_key, candidate
-            except Exception as e:
-                print(f"✗ Failed to load {candidate}: {e}")
-                continue
+        # One stat per candidate: a missing file surfaces as FileNotFoundError
+        try:
+            server_pub_key = load_key(candidate, os.stat(candidate).st_mtime)
+        except FileNotFoundError:
+            continue
+        except Exception as e:
+            log.warning("✗ Failed to load %s: %s", candidate, e)
+            continue
+        
+        # One write, and key metadata is only read when it will be shown
+        if log.isEnabledFor(logging.DEBUG):
+            fp, alg, sz = server_pub_key.fingerprint, server_pub_key.key_algorithm, server_pub_key.key_size
+            uids = getattr(server_pub_key, 'userids', ())  # computed property: evaluate once
+            uid_line = f"\n  User ID: {uids[0]}" if uids else ""
+            log.debug(f"✓ Loaded server public key from: {candidate}\n"
+                      f"  Fingerprint: {fp}\n  Algorithm: {alg}\n  Key size: {sz}{uid_line}")
+        
+        return server_pub_key, candidate
     
-    print("✗ Could not find valid server public key")
+    log.error("✗ Could not find valid server public key")
     return None, None
 
 def load_and_verify_client_key():
     """Load and verify the client private key."""
-    print("=== Loading Client Private Key ===")
-    
-    if not Path(CLIENT_PRIV_KEY_PATH).is_file():
-        print(f"✗ Client private key not found: {CLIENT_PRIV_KEY_PATH}")
-        return None
+    log.debug("=== Loading Client Private Key ===")
     
     try:
-        client_priv_key, _ = PGPKey.from_file(str(CLIENT_PRIV_KEY_PATH))
-        
-        if client_priv_key.is_public:
-            print("✗ Provided client key file is only a PUBLIC key; need the PRIVATE key")
-            return None
-        
-        print(f"✓ Loaded client private key from: {CLIENT_PRIV_KEY_PATH}")
-        print(f"  Fingerprint: {client_priv_key.fingerprint}")
-        print(f"  Is protected: {client_priv_key.is_protected}")
-        
-        # Get the public key part
-        client_pub_key = client_priv_key.pubkey
-        if hasattr(client_pub_key, 'userids') and client_pub_key.userids:
-            print(f"  User ID: {client_pub_key.userids[0]}")
-        
-        return client_priv_key
-        
+        client_priv_key = load_key(CLIENT_PRIV_KEY_PATH, os.stat(CLIENT_PRIV_KEY_PATH).st_mtime)
+    except FileNotFoundError:
+        log.error("✗ Client private key not found: %s", CLIENT_PRIV_KEY_PATH)
+        return None
     except Exception as e:
-        print(f"✗ Failed to load client private key: {e}")
+        log.error("✗ Failed to load client private key: %s", e)
         return None
+    
+    if client_priv_key.is_public:
+        log.error("✗ Provided client key file is only a PUBLIC key; need the PRIVATE key")
+        return None
+    
+    # One write, and key metadata is only read when it will be shown
+    if log.isEnabledFor(logging.DEBUG):
+        fp, protected = client_priv_key.fingerprint, client_priv_key.is_protected
+        uids = getattr(client_priv_key.pubkey, 'userids', ())  # computed property: evaluate once
+        uid_line = f"\n  User ID: {uids[0]}" if uids else ""
+        log.debug(f"✓ Loaded client private key from: {CLIENT_PRIV_KEY_PATH}\n"
+                  f"  Fingerprint: {fp}\n  Is protected: {protected}{uid_line}")
+    
+    return client_priv_key
 
 def verify_different_keys(server_pub_key, client_priv_key):
     """Verify that server and client keys are actually different."""
-    print("=== Verifying Key Differences ===")
+    log.debug("=== Verifying Key Differences ===")
     
-    server_fingerprint = server_pub_key.fingerprint
-    client_fingerprint = client_priv_key.fingerprint
-    
-    if server_fingerprint == client_fingerprint:
-        print("✗ ERROR: Server and client keys have the same fingerprint!")
-        print("  This means you're using the same key for both, which is wrong.")
-        print(f"  Fingerprint: {server_fingerprint}")
+    # Raw fingerprint bytes of the already-loaded keys
+    if bytes(server_pub_key.fingerprint) == bytes(client_priv_key.fingerprint):
+        log.error("✗ ERROR: Server and client keys have the same fingerprint!")
+        log.error("  This means you're using the same key for both, which is wrong.")
+        log.error("  Fingerprint: %s", server_pub_key.fingerprint)
         return False
     
-    print("✓ Server and client keys are different (good)")
-    print(f"  Server fingerprint: {server_fingerprint}")
-    print(f"  Client fingerprint: {client_fingerprint}")
+    log.debug("✓ Server and client keys are different (good)")
     return True
 
 def encrypt_to_server(obj: dict, server_pub_key) -> str:
     """Encrypt a dictionary to the server's public key."""
-    plaintext = json.dumps(obj, separators=(",", ":"), sort_keys=True)
+    plaintext = json_dumps(obj)
     msg = PGPMessage.new(plaintext)
     enc = server_pub_key.encrypt(msg)
-    armored = str(enc)
-    return base64.b64encode(armored.encode()).decode()
+    # Server expects base64 of the *armored* message; ASCII codecs skip UTF-8 scanning
+    return b64.b64encode(str(enc).encode("ascii")).decode("ascii")
 
-def decrypt_from_server(payload_b64: str, client_priv_key) -> dict:
-    """Decrypt a base64 payload from the server using client private key."""
-    armored = base64.b64decode(payload_b64)
-    pgp_msg = PGPMessage.from_blob(armored)
-    
+def unlock_client_key(client_priv_key):
+    """Return a context manager that keeps the client key unlocked for a whole handshake."""
     if client_priv_key.is_protected and CLIENT_PRIV_PASSPHRASE is None:
         raise SystemExit("Private key needs passphrase but none provided.")
     
-    if client_priv_key.is_protected:
-        with client_priv_key.unlock(CLIENT_PRIV_PASSPHRASE):
-            dec = client_priv_key.decrypt(pgp_msg)
-    else:
-        dec = client_priv_key.decrypt(pgp_msg)
+    return unlock_key(client_priv_key, CLIENT_PRIV_PASSPHRASE)
+
+_ARMOR_HDR = b"-----BEGIN PGP MESSAGE-----"
+_ARMOR_FTR = b"-----END PGP MESSAGE-----"
+
+def _dearmor(armored: bytes):
+    """Return the raw packet bytes inside an armored PGP MESSAGE, or None if it isn't one.
+
+    Lets PGPy take its binary path, skipping the armor regex and the
+    pure-Python CRC-24 (integrity is covered by the message's MDC).
+    """
+    start = armored.find(_ARMOR_HDR)
+    end = armored.find(_ARMOR_FTR, start)
+    if start < 0 or end < 0:
+        return None
+    
+    body = armored[start + len(_ARMOR_HDR):end].replace(b"\r\n", b"\n")
+    sep = body.find(b"\n\n")  # blank line closes the (possibly empty) armor headers
+    if sep < 0:
+        return None
     
-    return json.loads(dec.message)
+    data = body[sep + 2:]
+    crc = data.rfind(b"\n=")
+    if crc >= 0:
+        data = data[:crc]
+    return b64.b64decode(b"".join(data.split()))
+
+def decrypt_from_server(payload_b64: str, unlocked_key) -> dict:
+    """Decrypt a base64 payload from the server using the already-unlocked client key."""
+    armored = b64.b64decode(payload_b64)
+    raw = _dearmor(armored)
+    pgp_msg = PGPMessage.from_blob(raw if raw is not None else armored)
+    dec = unlocked_key.decrypt(pgp_msg)
+    return json_loads(dec.message)
 
 def test_server_connectivity():
     """Test basic server connectivity."""
-    print("=== Testing Server Connectivity ===")
+    log.debug("=== Testing Server Connectivity ===")
     
     try:
-        r = requests.get(f"{SERVER_BASE}/", timeout=10)
-        print(f"✓ Server reachable - Status: {r.status_code}")
+        r = SESSION.get(f"{SERVER_BASE}/", timeout=10)
+        log.debug("✓ Server reachable - Status: %s", r.status_code)
         return True
     except Exception as e:
-        print(f"✗ Server unreachable: {e}")
+        log.error("✗ Server unreachable: %s", e)
         return False
 
 def main():
@@ -151,106 +187,115 @@ def main():
     
     # Test server connectivity first
     if not test_server_connectivity():
-        print("\n❌ Cannot proceed - server is not reachable")
+        log.error("\n❌ Cannot proceed - server is not reachable")
         return False
     
     # Load keys
     server_pub_key, server_key_path = find_and_load_server_key()
     if not server_pub_key:
-        print("\n❌ Cannot proceed - no valid server public key found")
+        log.error("\n❌ Cannot proceed - no valid server public key found")
         return False
     
     client_priv_key = load_and_verify_client_key()
     if not client_priv_key:
-        print("\n❌ Cannot proceed - no valid client private key found")
+        log.error("\n❌ Cannot proceed - no valid client private key found")
         return False
     
     # Verify keys are different
     if not verify_different_keys(server_pub_key, client_priv_key):
-        print("\n❌ Cannot proceed - key configuration is invalid")
-        print("SOLUTION: You need to get the correct server public key.")
-        print("The current server public key appears to be the same as your client key.")
+        log.error("\n❌ Cannot proceed - key configuration is invalid")
+        log.error("SOLUTION: You need to get the correct server public key.")
+        log.error("The current server public key appears to be the same as your client key.")
         return False
     
-    print("\n=== Starting RMAP Handshake ===")
+    log.debug("\n=== Starting RMAP Handshake ===")
     
     try:
-        # ---- Message 1 ----
-        nonce_client = secrets.randbits(64)
-        msg1_payload_b64 = encrypt_to_server({"identity": IDENTITY, "nonceClient": nonce_client}, server_pub_key)
-        
-        print(f"[1] Sending Message1: identity={IDENTITY} nonceClient={nonce_client}")
-        print(f"    Using server key: {server_key_path}")
-        print(f"    Payload length: {len(msg1_payload_b64)} chars")
+        with unlock_client_key(client_priv_key) as unlocked_key:
+            # ---- Message 1 ----
+            nonce_client = rand64(64)
+            msg1_payload_b64 = encrypt_to_server({"identity": IDENTITY, "nonceClient": nonce_client}, server_pub_key)
         
-        r1 = requests.post(f"{SERVER_BASE}/api/rmap-initiate", json={"payload": msg1_payload_b64}, timeout=30)
+            log.debug("[1] Sending Message1: identity=%s nonceClient=%s", IDENTITY, nonce_client)
+            log.debug("    Using server key: %s", server_key_path)
+            log.debug("    Payload length: %s chars", len(msg1_payload_b64))
         
-        print(f"    Response status: {r1.status_code}")
-        print(f"    Response headers: {dict(r1.headers)}")
+            r1 = SESSION.post(f"{SERVER_BASE}/api/rmap-initiate", data=json_dumps({"payload": msg1_payload_b64}), headers=JSON_HEADERS, timeout=30)
         
-        if r1.status_code != 200:
-            print(f"    Response body: {r1.text}")
-            print(f"\n❌ Message 1 failed with status {r1.status_code}")
-            return False
+            log.debug("    Response status: %s", r1.status_code)
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug(f"    Response headers: Content-Type={r1.headers.get('Content-Type')} "
+                          f"Content-Length={r1.headers.get('Content-Length')}")
         
-        resp1 = r1.json()
-        if "payload" not in resp1:
-            print(f"    Server returned error: {resp1}")
-            return False
+            if r1.status_code != 200:
+                log.error("    Response body: %s", r1.text)
+                log.error("\n❌ Message 1 failed with status %s", r1.status_code)
+                return False
         
-        # ---- Decrypt server response (Message 1 response) ----
-        print("[2] Decrypting server response...")
-        obj1 = decrypt_from_server(resp1["payload"], client_priv_key)
-        print(f"    Decrypted Response1: {obj1}")
+            resp1 = r1.json()
+            if "payload" not in resp1:
+                log.error("    Server returned error: %s", resp1)
+                return False
         
-        if obj1.get("nonceClient") != nonce_client:
-            print("❌ nonceClient mismatch in server response")
-            return False
+            # ---- Decrypt server response (Message 1 response) ----
+            log.debug("[2] Decrypting server response...")
+            obj1 = decrypt_from_server(resp1["payload"], unlocked_key)
+            log.debug("    Decrypted Response1: %s", obj1)
         
-        nonce_server = obj1["nonceServer"]
+            if nonce(obj1, "nonceClient") != nonce_client:
+                log.error("❌ nonceClient mismatch in server response")
+                return False
         
-        # ---- Message 2 ----
-        print(f"[3] Sending Message2 with nonceServer={nonce_server}")
-        msg2_payload_b64 = encrypt_to_server({"nonceServer": nonce_server}, server_pub_key)
+            nonce_server = nonce(obj1, "nonceServer")
         
-        r2 = requests.post(f"{SERVER_BASE}/api/rmap-get-link", json={"payload": msg2_payload_b64}, timeout=30)
+            # ---- Message 2 ----
+            log.debug("[3] Sending Message2 with nonceServer=%s", nonce_server)
+            msg2_payload_b64 = encrypt_to_server({"nonceServer": nonce_server}, server_pub_key)
         
-        print(f"    Response status: {r2.status_code}")
+            r2 = SESSION.post(f"{SERVER_BASE}/api/rmap-get-link", data=json_dumps({"payload": msg2_payload_b64}), headers=JSON_HEADERS, timeout=30)
         
-        if r2.status_code != 200:
-            print(f"    Response body: {r2.text}")
-            print(f"\n❌ Message 2 failed with status {r2.status_code}")
-            return False
+            log.debug("    Response status: %s", r2.status_code)
         
-        resp2 = r2.json()
-        if "result" not in resp2:
-            print(f"    Server returned error: {resp2}")
-            return False
+            if r2.status_code != 200:
+                log.error("    Response body: %s", r2.text)
+                log.error("\n❌ Message 2 failed with status %s", r2.status_code)
+                return False
         
-        link_token = resp2["result"]
-        print(f"✓ Link token received: {link_token}")
+            resp2 = r2.json()
+            if "result" not in resp2:
+                log.error("    Server returned error: %s", resp2)
+                return False
         
-        # ---- Download watermarked PDF ----
-        print("[4] Downloading watermarked PDF...")
-        pdf_resp = requests.get(f"{SERVER_BASE}/api/get-version/{link_token}", timeout=30)
+            link_token = resp2["result"]
+            log.debug("✓ Link token received: %s", link_token)
         
-        if pdf_resp.status_code != 200 or pdf_resp.headers.get("Content-Type") != "application/pdf":
-            print(f"❌ Failed to download PDF: {pdf_resp.status_code} {pdf_resp.text[:200]}")
-            return False
+            # ---- Download watermarked PDF ----
+            log.debug("[4] Downloading watermarked PDF...")
+            fname = f"watermarked_{IDENTITY}.pdf"
+            with SESSION.get(f"{SERVER_BASE}/api/get-version/{link_token}", timeout=30, stream=True) as pdf_resp:
+                if pdf_resp.status_code != 200 or pdf_resp.headers.get("Content-Type") != "application/pdf":
+                    log.error("❌ Failed to download PDF: %s %s", pdf_resp.status_code, pdf_resp.text[:200])
+                    return False
         
-        fname = f"watermarked_{IDENTITY}.pdf"
-        with open(fname, "wb") as f:
-            f.write(pdf_resp.content)
+                # Stream socket -> disk in 64 KiB chunks instead of buffering the whole PDF
+                pdf_resp.raw.decode_content = True
+                with open(fname, "wb") as f:
+                    shutil.copyfileobj(pdf_resp.raw, f, length=1 << 16)
+                    size = f.tell()
         
-        print(f"✅ Success! Saved watermarked PDF: {fname} ({len(pdf_resp.content)} bytes)")
-        return True
+            print(f"✅ Success! Saved watermarked PDF: {fname} ({size} bytes)")
+            return True
         
     except Exception as e:
-        print(f"\n❌ Unexpected error during handshake: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("\n❌ Unexpected error during handshake: %s", e)
         return False
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RMAP client handshake")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print the step-by-step handshake trace")
+    args = parser.parse_args()
+    logging.basicConfig(stream=sys.stdout, format="%(message)s")
+    log.setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+    
     success = main()
     sys.exit(0 if success else 1)
\ No newline at end of file
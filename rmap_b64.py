@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Numba-compiled base64 codec for RMAP payloads.
+
+Second-best option for deployments that cannot install pybase64. The
+RMAP clients route their payload encode/decode through this module when
+USE_NUMBA_B64=1 is set. Exposes b64encode/b64decode with the same
+bytes-in/bytes-out behaviour as the stdlib base64 module (strict
+decoding: no whitespace, padding required).
+"""
+
+import binascii
+
+import numba
+import numpy as np
+
+_ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+_PAD = 61  # ord("=")
+_INVALID = 255
+
+ENC_LUT = np.frombuffer(_ALPHABET, dtype=np.uint8).copy()
+DEC_LUT = np.full(256, _INVALID, dtype=np.uint8)
+DEC_LUT[ENC_LUT] = np.arange(64, dtype=np.uint8)
+
+
+@numba.njit(cache=True)
+def b64enc_swar(src, lut):
+    """Encode uint8[:] -> uint8[:]; each 3-byte group is packed into one uint32 word."""
+    n = src.shape[0]
+    full = n - n % 3
+    out = np.empty((n + 2) // 3 * 4, dtype=np.uint8)
+    j = 0
+    for i in range(0, full, 3):
+        w = (np.uint32(src[i]) << 16) | (np.uint32(src[i + 1]) << 8) | np.uint32(src[i + 2])
+        out[j] = lut[(w >> 18) & 63]
+        out[j + 1] = lut[(w >> 12) & 63]
+        out[j + 2] = lut[(w >> 6) & 63]
+        out[j + 3] = lut[w & 63]
+        j += 4
+
+    rem = n - full
+    if rem:
+        w = np.uint32(src[full]) << 16
+        if rem == 2:
+            w |= np.uint32(src[full + 1]) << 8
+        out[j] = lut[(w >> 18) & 63]
+        out[j + 1] = lut[(w >> 12) & 63]
+        out[j + 2] = lut[(w >> 6) & 63] if rem == 2 else _PAD
+        out[j + 3] = _PAD
+    return out
+
+
+@numba.njit(cache=True)
+def b64dec_swar(src, lut):
+    """Decode uint8[:] -> (uint8[:], error offset or -1)."""
+    n = src.shape[0]
+    if n % 4:
+        return np.empty(0, dtype=np.uint8), n
+
+    pad = 0
+    if n and src[n - 1] == _PAD:
+        pad = 2 if src[n - 2] == _PAD else 1
+
+    out = np.empty(n // 4 * 3 - pad, dtype=np.uint8)
+    j = 0
+    for i in range(0, n, 4):
+        last = i == n - 4
+        a = lut[src[i]]
+        b = lut[src[i + 1]]
+        c = np.uint8(0) if last and pad == 2 else lut[src[i + 2]]
+        d = np.uint8(0) if last and pad >= 1 else lut[src[i + 3]]
+        if a == _INVALID or b == _INVALID or c == _INVALID or d == _INVALID:
+            return out, i
+
+        w = (np.uint32(a) << 18) | (np.uint32(b) << 12) | (np.uint32(c) << 6) | np.uint32(d)
+        out[j] = (w >> 16) & 255
+        if last and pad == 2:
+            break
+        out[j + 1] = (w >> 8) & 255
+        if last and pad == 1:
+            break
+        out[j + 2] = w & 255
+        j += 3
+    return out, -1
+
+
+def b64encode(data) -> bytes:
+    """Base64-encode bytes-like ``data``."""
+    return b64enc_swar(np.frombuffer(data, dtype=np.uint8), ENC_LUT).tobytes()
+
+
+def b64decode(data) -> bytes:
+    """Base64-decode ``data`` (``str`` or bytes-like); raises binascii.Error on bad input."""
+    if isinstance(data, str):
+        data = data.encode("ascii")
+    out, err = b64dec_swar(np.frombuffer(data, dtype=np.uint8), DEC_LUT)
+    if err >= 0:
+        raise binascii.Error(f"Invalid base64 input at offset {err}")
+    return out.tobytes()
@@ -1,11 +1,14 @@
 import os
 import sys
-import json
-import base64
-import secrets
-import urllib.request
+import logging
+import argparse
+import shutil
+from contextlib import ExitStack, contextmanager
 
-from pgpy import PGPKey, PGPMessage
+import requests
+from pgpy import PGPMessage
+
+from rmap_common import b64, json_dumps, json_loads, log, JSON_HEADERS, rand64, nonce, load_key, HandshakeKey
 
 # CONFIGURATION - Matching the working rmap_client_test.py
 IDENTITY = "Group_04"  # Must match what server expects
@@ -16,145 +19,146 @@ SERVER_PUB_KEY_PATH = "pub.asc"    # Use pub.asc as server key (same as working
 SERVER_URL = "http://localhost:5000"        # Change if server is remote
 
 class WorkingIdentityManager:
-    def __init__(self, client_priv, server_pub, passphrase):
+    def __init__(self, client_priv, server_pub, passphrase, session=None):
         self.client_priv = client_priv
         self.server_pub = server_pub
         self.passphrase = passphrase
+        self.session = session if session is not None else requests.Session()
+        self._key = HandshakeKey(client_priv, passphrase)
+
+    @contextmanager
+    def unlocked(self):
+        """Keep the client private key unlocked for the duration of a handshake"""
+        with self._key.unlocked():
+            yield self
 
     def encrypt_for_server(self, obj):
         """Encrypt a message for the server"""
-        msg = json.dumps(obj, separators=(",", ":"), sort_keys=True)  # Match working client format
+        msg = json_dumps(obj)  # Match working client format
         pgpmsg = PGPMessage.new(msg)
         encrypted = self.server_pub.encrypt(pgpmsg)
         armored = str(encrypted)  # Convert to armored string first
-        return base64.b64encode(armored.encode()).decode()
+        return b64.b64encode(armored.encode("ascii")).decode("ascii")
 
     def decrypt_for_client(self, b64msg):
         """Decrypt a message using the client's private key with context manager"""
-        armored = base64.b64decode(b64msg)
+        armored = b64.b64decode(b64msg)
         pgpmsg = PGPMessage.from_blob(armored)
-        
-        # Use context manager like the working client
-        with self.client_priv.unlock(self.passphrase) as unlocked_key:
-            decrypted = unlocked_key.decrypt(pgpmsg)
-            return json.loads(decrypted.message)
+        decrypted = self._key.decrypt(pgpmsg)
+        return json_loads(decrypted.message)
 
 def main():
-    print("Loading keys...")
+    log.debug("Loading keys...")
     
     # Load keys
     try:
-        client_priv, _ = PGPKey.from_file(CLIENT_PRIV_KEY_PATH)
-        server_pub, _ = PGPKey.from_file(SERVER_PUB_KEY_PATH)
-        print("Keys loaded successfully")
+        client_priv = load_key(CLIENT_PRIV_KEY_PATH, os.stat(CLIENT_PRIV_KEY_PATH).st_mtime)
+        server_pub = load_key(SERVER_PUB_KEY_PATH, os.stat(SERVER_PUB_KEY_PATH).st_mtime)
+        log.debug("Keys loaded successfully")
         
         # Verify key setup
-        print(f"Client private key fingerprint: {client_priv.fingerprint}")
-        print(f"Server public key fingerprint: {server_pub.fingerprint}")
-        print(f"Using identity: {IDENTITY}")
+        log.debug("Client private key fingerprint: %s", client_priv.fingerprint)
+        log.debug("Server public key fingerprint: %s", server_pub.fingerprint)
+        log.debug("Using identity: %s", IDENTITY)
         
     except Exception as e:
-        print(f"Failed to load keys: {e}")
-        sys.exit(1)
-
-    # Test key unlocking
-    print("Testing private key unlock...")
-    try:
-        with client_priv.unlock(CLIENT_PRIV_PASSPHRASE) as unlocked_key:
-            print(f"Key unlock test successful. Unlocked status: {unlocked_key.is_unlocked}")
-    except Exception as e:
-        print(f"Key unlock test failed: {e}")
+        log.error("Failed to load keys: %s", e)
         sys.exit(1)
 
     # Create identity manager
     try:
         idm = WorkingIdentityManager(client_priv, server_pub, CLIENT_PRIV_PASSPHRASE)
-        print("Identity manager created successfully")
+        log.debug("Identity manager created successfully")
     except Exception as e:
-        print(f"Failed to create identity manager: {e}")
+        log.error("Failed to create identity manager: %s", e)
         sys.exit(1)
 
-    print("Starting RMAP protocol...")
+    log.debug("Starting RMAP protocol...")
+
+    with ExitStack() as stack:
+        # Test key unlocking: the key stays unlocked for the handshake below
+        log.debug("Testing private key unlock...")
+        try:
+            stack.enter_context(idm.unlocked())
+            log.debug("Key unlock test successful")
+        except Exception as e:
+            log.error("Key unlock test failed: %s", e)
+            sys.exit(1)
 
-    # Step 1: Initiate handshake
-    print("Step 1: Initiating handshake...")
-    nonce_client = secrets.randbits(64)
+        # Step 1: Initiate handshake
+        log.debug("Step 1: Initiating handshake...")
+        nonce_client = rand64(64)
     
-    try:
-        payload1_b64 = idm.encrypt_for_server({"identity": IDENTITY, "nonceClient": nonce_client})
-        print(f"[+] Sending Message1: identity={IDENTITY} nonceClient={nonce_client}")
-        print(f"[DEBUG] Payload length: {len(payload1_b64)}")
-        print(f"[DEBUG] Payload first 100 chars: {payload1_b64[:100]}...")
+        try:
+            payload1_b64 = idm.encrypt_for_server({"identity": IDENTITY, "nonceClient": nonce_client})
+            log.debug("[+] Sending Message1: identity=%s nonceClient=%s", IDENTITY, nonce_client)
+            log.debug("[DEBUG] Payload length: %s", len(payload1_b64))
+            log.debug("[DEBUG] Payload first 100 chars: %s...", payload1_b64[:100])
         
-        req = urllib.request.Request(
-            f"{SERVER_URL}/api/rmap-initiate",
-            data=json.dumps({"payload": payload1_b64}).encode(),
-            headers={"Content-Type": "application/json"}
-        )
-        
-        with urllib.request.urlopen(req, timeout=30) as resp:
-            body1 = json.loads(resp.read().decode())
-            print(f"[DEBUG] Response status: {resp.status}")
+            resp = idm.session.post(f"{SERVER_URL}/api/rmap-initiate", data=json_dumps({"payload": payload1_b64}), headers=JSON_HEADERS, timeout=30)
+            log.debug("[DEBUG] Response status: %s", resp.status_code)
+            resp.raise_for_status()
+            body1 = resp.json()
             
-        payload2_b64 = body1["payload"]
-        print("Step 1 completed successfully")
+            payload2_b64 = body1["payload"]
+            log.debug("Step 1 completed successfully")
         
-    except Exception as e:
-        print(f"Step 1 failed: {e}")
-        sys.exit(1)
+        except Exception as e:
+            log.error("Step 1 failed: %s", e)
+            sys.exit(1)
 
-    # Step 2: Decrypt server response and send nonceServer
-    print("Step 2: Processing server response...")
-    try:
-        obj = idm.decrypt_for_client(payload2_b64)
-        print(f"[+] Decrypted server response: {obj}")
+        # Step 2: Decrypt server response and send nonceServer
+        log.debug("Step 2: Processing server response...")
+        try:
+            obj = idm.decrypt_for_client(payload2_b64)
+            log.debug("[+] Decrypted server response: %s", obj)
         
-        # Verify nonce
-        received_nonce = int(obj["nonceClient"])
-        if received_nonce != nonce_client:
-            raise Exception(f"NonceClient mismatch! Expected: {nonce_client}, Got: {received_nonce}")
+            # Verify nonce
+            received_nonce = nonce(obj, "nonceClient")
+            if received_nonce != nonce_client:
+                raise Exception(f"NonceClient mismatch! Expected: {nonce_client}, Got: {received_nonce}")
             
-        nonce_server = int(obj["nonceServer"])
-        print("Step 2: Server response validated successfully")
+            nonce_server = nonce(obj, "nonceServer")
+            log.debug("Step 2: Server response validated successfully")
         
-    except Exception as e:
-        print(f"Step 2 failed: {e}")
-        sys.exit(1)
+        except Exception as e:
+            log.error("Step 2 failed: %s", e)
+            sys.exit(1)
 
-    print("Step 3: Sending nonce confirmation...")
-    try:
-        payload3_b64 = idm.encrypt_for_server({"nonceServer": nonce_server})
-        req2 = urllib.request.Request(
-            f"{SERVER_URL}/api/rmap-get-link",
-            data=json.dumps({"payload": payload3_b64}).encode(),
-            headers={"Content-Type": "application/json"}
-        )
-        
-        with urllib.request.urlopen(req2, timeout=30) as resp:
-            body2 = json.loads(resp.read().decode())
+        log.debug("Step 3: Sending nonce confirmation...")
+        try:
+            payload3_b64 = idm.encrypt_for_server({"nonceServer": nonce_server})
+            resp = idm.session.post(f"{SERVER_URL}/api/rmap-get-link", data=json_dumps({"payload": payload3_b64}), headers=JSON_HEADERS, timeout=30)
+            resp.raise_for_status()
+            body2 = resp.json()
 
-        link = body2["result"]
-        print(f"Got link: {link} (identity: {body2.get('identity', '')})")
+            link = body2["result"]
+            log.debug("Got link: %s (identity: %s)", link, body2.get('identity', ''))
         
-    except Exception as e:
-        print(f"Step 3 failed: {e}")
-        sys.exit(1)
+        except Exception as e:
+            log.error("Step 3 failed: %s", e)
+            sys.exit(1)
 
     # Step 4: Download the watermarked PDF
-    print("Step 4: Downloading watermarked PDF...")
+    log.debug("Step 4: Downloading watermarked PDF...")
     try:
-        req3 = urllib.request.Request(f"{SERVER_URL}/api/get-version/{link}")
-        with urllib.request.urlopen(req3, timeout=30) as resp:
-            pdf_data = resp.read()
-            
         out_fn = f"{IDENTITY}_watermarked.pdf"
-        with open(out_fn, "wb") as f:
-            f.write(pdf_data)
+        with idm.session.get(f"{SERVER_URL}/api/get-version/{link}", timeout=30, stream=True) as resp:
+            resp.raise_for_status()
+            resp.raw.decode_content = True
+            with open(out_fn, "wb") as f:
+                shutil.copyfileobj(resp.raw, f, length=1 << 16)
         print(f"Success! Saved watermarked PDF to: {out_fn}")
         
     except Exception as e:
-        print(f"Step 4 failed: {e}")
+        log.error("Step 4 failed: %s", e)
         sys.exit(1)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch a watermarked PDF over RMAP")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print the step-by-step handshake trace")
+    args = parser.parse_args()
+    logging.basicConfig(stream=sys.stdout, format="%(message)s")
+    log.setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+
     main()
\ No newline at end of file
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Helpers shared by the RMAP client scripts.
+
+Picks the fastest available base64/JSON codecs, caches parsed key files
+and keeps a private key unlocked across one handshake.
+"""
+
+import os
+import json
+import logging
+import secrets
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+
+if os.environ.get("USE_NUMBA_B64") == "1":  # JIT codec for hosts without pybase64
+    import rmap_b64 as b64
+else:
+    try:  # SIMD base64; the stdlib module has the same API
+        import pybase64 as b64
+    except ImportError:
+        import base64 as b64
+
+# C JSON codec. Not byte-identical to the json fallback: orjson writes raw UTF-8
+# where json.dumps escapes to \uXXXX, and orjson.loads turns integers beyond
+# 64 bits into floats (see nonce() below)
+try:
+    import orjson
+
+    def json_dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+
+    json_loads = orjson.loads
+except ImportError:
+    def json_dumps(obj):
+        return json.dumps(obj, separators=(",", ":"), sort_keys=True).encode()
+
+    json_loads = json.loads
+
+from pgpy import PGPKey
+
+# Step traces are DEBUG (enable with --verbose); failures are ERROR
+log = logging.getLogger("rmap")
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Bound once: nonces are drawn without re-resolving secrets' module-level instance
+rand64 = secrets.SystemRandom().getrandbits
+
+
+def nonce(obj, key):
+    """Return ``obj[key]`` if it is a 64-bit unsigned int; raise ValueError otherwise.
+
+    Guards against orjson.loads silently turning a larger integer into a float.
+    """
+    value = obj[key]
+    if type(value) is not int or not 0 <= value < 1 << 64:
+        raise ValueError(f"{key} is not a 64-bit integer: {value!r}")
+    return value
+
+
+@lru_cache(maxsize=8)
+def load_key(path, mtime):
+    """Parse a key file; cached per (path, mtime) so unchanged files are parsed once."""
+    return PGPKey.from_file(path)[0]
+
+
+def unlock_key(key, passphrase):
+    """Context manager yielding ``key`` unlocked; a no-op if it already is (or is unprotected)."""
+    if key.is_unlocked:
+        return nullcontext(key)
+    return key.unlock(passphrase)
+
+
+class HandshakeKey:
+    """A private key that can be held unlocked for the duration of one handshake."""
+
+    def __init__(self, key, passphrase):
+        self.key = key
+        self.passphrase = passphrase
+        self._unlocked = None
+
+    @contextmanager
+    def unlocked(self):
+        with unlock_key(self.key, self.passphrase) as unlocked_key:
+            self._unlocked = unlocked_key
+            try:
+                yield self
+            finally:
+                self._unlocked = None
+
+    def decrypt(self, pgpmsg):
+        """Decrypt with the held key, or unlock just for this call outside a handshake."""
+        if self._unlocked is not None:
+            return self._unlocked.decrypt(pgpmsg)
+
+        with unlock_key(self.key, self.passphrase) as unlocked_key:
+            return unlocked_key.decrypt(pgpmsg)
@@ -6,12 +6,23 @@ Just modify the configuration section and run
 
 import os
 import sys
-import json
-import base64
-import secrets
-import urllib.request
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from typing import NamedTuple, Optional
+from urllib.parse import urlsplit
 
-from pgpy import PGPKey, PGPMessage
+try:  # httpx negotiates HTTP/2 only when the h2 package is installed
+    import h2  # noqa: F401
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+import httpx
+from pgpy import PGPMessage
+
+from rmap_common import b64, json_dumps, json_loads, log, JSON_HEADERS, rand64, nonce, load_key, unlock_key, HandshakeKey
 
 # ===== CONFIGURATION - MODIFY THESE VALUES =====
 YOUR_IDENTITY = "Group_04"  # Your group (always Group_04)
@@ -22,171 +33,220 @@ YOUR_PASSPHRASE = "Grabbed-Harbor-Breathing-Growth-Jump-Ability-Never-Ask-Worth6
 TARGET_SERVER_URL = "http://144.24.5.229:5000"  # 🔴 CHANGE THIS: Target group's server IP
 TARGET_GROUP_PUBKEY = "Group_04.asc"            # 🔴 CHANGE THIS: Target group's public key file
 
+# BATCH MODE - every (server URL, public key file) pair is tested in parallel
+TARGETS = [
+    (TARGET_SERVER_URL, TARGET_GROUP_PUBKEY),
+]
+MAX_WORKERS = 8
+
 # ================================================
 
+class Result(NamedTuple):
+    target_url: str
+    target_pubkey: str
+    filename: Optional[str]  # downloaded PDF, None on failure
+    error: Optional[str]     # None on success
+
 class SimpleRMAPClient:
-    def __init__(self, your_priv_key, target_pub_key, passphrase):
+    def __init__(self, your_priv_key, target_pub_key, passphrase, session):
         self.your_priv_key = your_priv_key
         self.target_pub_key = target_pub_key
         self.passphrase = passphrase
+        self.session = session  # httpx.Client owned (and closed) by the caller
+        self._key = HandshakeKey(your_priv_key, passphrase)
+
+    @contextmanager
+    def unlocked(self):
+        """Keep your private key unlocked for the duration of a handshake"""
+        with self._key.unlocked():
+            yield self
 
     def encrypt_to_target(self, data):
         """Encrypt data to target server"""
-        msg = json.dumps(data, separators=(",", ":"), sort_keys=True)
+        msg = json_dumps(data)
         pgpmsg = PGPMessage.new(msg)
         encrypted = self.target_pub_key.encrypt(pgpmsg)
-        return base64.b64encode(str(encrypted).encode()).decode()
+        return b64.b64encode(str(encrypted).encode("ascii")).decode("ascii")
 
     def decrypt_from_target(self, b64_data):
         """Decrypt response from target server"""
-        armored = base64.b64decode(b64_data)
+        armored = b64.b64decode(b64_data)
         pgpmsg = PGPMessage.from_blob(armored)
-        
-        with self.your_priv_key.unlock(self.passphrase) as unlocked_key:
-            decrypted = unlocked_key.decrypt(pgpmsg)
-            return json.loads(decrypted.message)
-
-def main():
-    print(f"🎯 Testing RMAP with target group")
-    print(f"   Your identity: {YOUR_IDENTITY}")
-    print(f"   Target server: {TARGET_SERVER_URL}")
-    print(f"   Target pubkey: {TARGET_GROUP_PUBKEY}")
+        decrypted = self._key.decrypt(pgpmsg)
+        return json_loads(decrypted.message)
+
+def output_filename(target_url, target_pubkey_path):
+    """PDF name for one target: key name plus server host, so parallel targets never share a file"""
+    target_name = os.path.basename(target_pubkey_path).replace('.asc', '').replace('Group_', 'Group')
+    host = urlsplit(target_url).netloc.replace(':', '_')
+    return f"{YOUR_IDENTITY}_from_{target_name}_{host}.pdf"
+
+def run_one(target_url, target_pubkey_path, your_priv):
+    """Run one RMAP handshake + PDF download against a single target group"""
+    log.debug("🎯 Testing RMAP with target group")
+    log.debug("   Your identity: %s", YOUR_IDENTITY)
+    log.debug("   Target server: %s", target_url)
+    log.debug("   Target pubkey: %s", target_pubkey_path)
     
-    # Load keys
+    # Load target key
     try:
-        print("\n📂 Loading keys...")
-        your_priv, _ = PGPKey.from_file(YOUR_PRIV_KEY)
-        target_pub, _ = PGPKey.from_file(TARGET_GROUP_PUBKEY)
-        
-        print(f"   ✓ Your private key: {your_priv.fingerprint}")
-        print(f"   ✓ Target public key: {target_pub.fingerprint}")
+        target_pub = load_key(target_pubkey_path, os.stat(target_pubkey_path).st_mtime)
+        log.debug("   ✓ Target public key: %s", target_pub.fingerprint)
         
     except FileNotFoundError as e:
-        print(f"   ❌ Key file not found: {e}")
-        print(f"\nMake sure you have:")
-        print(f"   - {YOUR_PRIV_KEY} (your private key)")
-        print(f"   - {TARGET_GROUP_PUBKEY} (target group's public key)")
-        return
-    except Exception as e:
-        print(f"   ❌ Error loading keys: {e}")
-        return
-
-    # Test key unlock
-    try:
-        with your_priv.unlock(YOUR_PASSPHRASE):
-            print("   ✓ Your key unlocks successfully")
+        log.error("   ❌ Key file not found: %s", e)
+        log.error("\nMake sure you have:")
+        log.error("   - %s (target group's public key)", target_pubkey_path)
+        return Result(target_url, target_pubkey_path, None, f"Key file not found: {e}")
     except Exception as e:
-        print(f"   ❌ Key unlock failed: {e}")
-        return
-
-    # Create client
-    client = SimpleRMAPClient(your_priv, target_pub, YOUR_PASSPHRASE)
-
+        log.error("   ❌ Error loading keys: %s", e)
+        return Result(target_url, target_pubkey_path, None, f"Error loading keys: {e}")
+
+    # Each target gets its own persistent HTTP client, reused for both POSTs
+    # and the PDF download (one connection; HTTP/2 where the server offers it).
+    # httpx does not follow redirects by default; urllib and requests did
+    with httpx.Client(http2=HTTP2, timeout=30.0, follow_redirects=True) as http:
+        client = SimpleRMAPClient(your_priv, target_pub, YOUR_PASSPHRASE, session=http)
+        return _handshake(client, target_url, target_pubkey_path)
+
+def _handshake(client, target_url, target_pubkey_path):
+    """RMAP messages 1-2 and the PDF download for one target"""
     # RMAP Protocol
-    print(f"\n🔄 Starting RMAP handshake...")
+    log.debug("\n🔄 Starting RMAP handshake with %s...", target_url)
     
-    # Step 1: Send identity + nonce
-    nonce_client = secrets.randbits(64)
-    try:
-        print("   Step 1: Sending identity and client nonce...")
-        payload = client.encrypt_to_target({
-            "identity": YOUR_IDENTITY,
-            "nonceClient": nonce_client
-        })
-        
-        response = urllib.request.urlopen(
-            urllib.request.Request(
-                f"{TARGET_SERVER_URL}/api/rmap-initiate",
-                data=json.dumps({"payload": payload}).encode(),
-                headers={"Content-Type": "application/json"}
-            ),
-            timeout=30
-        )
-        
-        result = json.loads(response.read().decode())
-        print("   ✓ Server responded to handshake")
-        
-    except Exception as e:
-        print(f"   ❌ Step 1 failed: {e}")
-        print(f"\nPossible issues:")
-        print(f"   - Server {TARGET_SERVER_URL} is not reachable")
-        print(f"   - Server doesn't have your public key for identity {YOUR_IDENTITY}")
-        return
+    with client.unlocked():
+        # Step 1: Send identity + nonce
+        nonce_client = rand64(64)
+        try:
+            log.debug("   Step 1: Sending identity and client nonce...")
+            payload = client.encrypt_to_target({
+                "identity": YOUR_IDENTITY,
+                "nonceClient": nonce_client
+            })
+        
+            response = client.session.post(f"{target_url}/api/rmap-initiate", content=json_dumps({"payload": payload}), headers=JSON_HEADERS)
+            response.raise_for_status()
+            result = response.json()
+            log.debug("   ✓ Server responded to handshake")
+        
+        except Exception as e:
+            log.error("   ❌ Step 1 failed: %s", e)
+            log.error("\nPossible issues:")
+            log.error("   - Server %s is not reachable", target_url)
+            log.error("   - Server doesn't have your public key for identity %s", YOUR_IDENTITY)
+            return Result(target_url, target_pubkey_path, None, f"Step 1 failed: {e}")
+
+        # Step 2: Decrypt response and verify nonce
+        try:
+            log.debug("   Step 2: Decrypting server response...")
+            server_data = client.decrypt_from_target(result["payload"])
+        
+            if nonce(server_data, "nonceClient") != nonce_client:
+                raise Exception("Nonce verification failed!")
+        
+            nonce_server = nonce(server_data, "nonceServer")
+            log.debug("   ✓ Nonce verified, server nonce: %s", nonce_server)
+        
+        except Exception as e:
+            log.error("   ❌ Step 2 failed: %s", e)
+            log.error("\nPossible issues:")
+            log.error("   - Server encrypted response with wrong key")
+            log.error("   - Your identity %s not registered on their server", YOUR_IDENTITY)
+            log.error("   - They don't have your correct public key")
+            return Result(target_url, target_pubkey_path, None, f"Step 2 failed: {e}")
+
+        # Step 3: Send server nonce back and get link
+        try:
+            log.debug("   Step 3: Confirming server nonce...")
+            payload = client.encrypt_to_target({"nonceServer": nonce_server})
+        
+            response = client.session.post(f"{target_url}/api/rmap-get-link", content=json_dumps({"payload": payload}), headers=JSON_HEADERS)
+            response.raise_for_status()
+            result = response.json()
+            download_link = result["result"]
+            confirmed_identity = result.get("identity", "unknown")
+        
+            log.debug("   ✓ Got download link: %s", download_link)
+            log.debug("   ✓ Server confirmed identity: %s", confirmed_identity)
+        
+        except Exception as e:
+            log.error("   ❌ Step 3 failed: %s", e)
+            return Result(target_url, target_pubkey_path, None, f"Step 3 failed: {e}")
 
-    # Step 2: Decrypt response and verify nonce
-    try:
-        print("   Step 2: Decrypting server response...")
-        server_data = client.decrypt_from_target(result["payload"])
-        
-        if int(server_data["nonceClient"]) != nonce_client:
-            raise Exception("Nonce verification failed!")
-        
-        nonce_server = int(server_data["nonceServer"])
-        print(f"   ✓ Nonce verified, server nonce: {nonce_server}")
-        
-    except Exception as e:
-        print(f"   ❌ Step 2 failed: {e}")
-        print(f"\nPossible issues:")
-        print(f"   - Server encrypted response with wrong key")
-        print(f"   - Your identity {YOUR_IDENTITY} not registered on their server")
-        print(f"   - They don't have your correct public key")
-        return
-
-    # Step 3: Send server nonce back and get link
+    # Step 4: Download PDF
     try:
-        print("   Step 3: Confirming server nonce...")
-        payload = client.encrypt_to_target({"nonceServer": nonce_server})
+        log.debug("   Step 4: Downloading watermarked PDF...")
         
-        response = urllib.request.urlopen(
-            urllib.request.Request(
-                f"{TARGET_SERVER_URL}/api/rmap-get-link",
-                data=json.dumps({"payload": payload}).encode(),
-                headers={"Content-Type": "application/json"}
-            ),
-            timeout=30
-        )
+        filename = output_filename(target_url, target_pubkey_path)
         
-        result = json.loads(response.read().decode())
-        download_link = result["result"]
-        confirmed_identity = result.get("identity", "unknown")
+        with client.session.stream("GET", f"{target_url}/api/get-version/{download_link}") as response:
+            response.raise_for_status()
+            with open(filename, 'wb') as f:
+                for chunk in response.iter_bytes(1 << 16):
+                    f.write(chunk)
+                size = f.tell()
         
-        print(f"   ✓ Got download link: {download_link}")
-        print(f"   ✓ Server confirmed identity: {confirmed_identity}")
+        log.debug("   ✓ Downloaded %s bytes", size)
+        log.debug("   ✓ Saved as: %s", filename)
         
     except Exception as e:
-        print(f"   ❌ Step 3 failed: {e}")
+        log.error("   ❌ Step 4 failed: %s", e)
+        return Result(target_url, target_pubkey_path, None, f"Step 4 failed: {e}")
+
+    return Result(target_url, target_pubkey_path, filename, None)
+
+def main():
+    # Workers write their PDFs concurrently: refuse targets that would share an output file
+    filenames = [output_filename(url, pubkey) for url, pubkey in TARGETS]
+    duplicates = sorted({name for name in filenames if filenames.count(name) > 1})
+    if duplicates:
+        log.error("   ❌ Several TARGETS would write the same file: %s", ', '.join(duplicates))
         return
 
-    # Step 4: Download PDF
+    # Load your key once for the whole batch
     try:
-        print("   Step 4: Downloading watermarked PDF...")
-        
-        response = urllib.request.urlopen(
-            f"{TARGET_SERVER_URL}/api/get-version/{download_link}",
-            timeout=30
-        )
-        
-        pdf_data = response.read()
-        
-        # Create filename with target info
-        target_name = TARGET_GROUP_PUBKEY.replace('.asc', '').replace('Group_', 'Group')
-        filename = f"{YOUR_IDENTITY}_from_{target_name}.pdf"
-        
-        with open(filename, 'wb') as f:
-            f.write(pdf_data)
-        
-        print(f"   ✓ Downloaded {len(pdf_data)} bytes")
-        print(f"   ✓ Saved as: {filename}")
+        log.debug("\n📂 Loading keys...")
+        your_priv = load_key(YOUR_PRIV_KEY, os.stat(YOUR_PRIV_KEY).st_mtime)
+        log.debug("   ✓ Your private key: %s", your_priv.fingerprint)
         
+    except FileNotFoundError as e:
+        log.error("   ❌ Key file not found: %s", e)
+        log.error("\nMake sure you have:")
+        log.error("   - %s (your private key)", YOUR_PRIV_KEY)
+        return
     except Exception as e:
-        print(f"   ❌ Step 4 failed: {e}")
+        log.error("   ❌ Error loading keys: %s", e)
         return
 
-    print(f"\n🎉 SUCCESS! RMAP completed with target group")
-    print(f"\n📋 Summary:")
-    print(f"   - Your identity: {YOUR_IDENTITY}")
-    print(f"   - Target server: {TARGET_SERVER_URL}")
-    print(f"   - Downloaded: {filename}")
+    with ExitStack() as stack:
+        # Unlock once here: workers share the unlocked key instead of each
+        # unlocking (and re-locking) the same PGPKey object concurrently
+        try:
+            unlocked_priv = stack.enter_context(unlock_key(your_priv, YOUR_PASSPHRASE))
+            log.debug("   ✓ Your key unlocks successfully")
+        except Exception as e:
+            log.error("   ❌ Key unlock failed: %s", e)
+            return
+
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+            results = list(ex.map(lambda t: run_one(*t, unlocked_priv), TARGETS))
+
+    for r in results:
+        if r.error is not None:
+            print(f"\n❌ RMAP failed with {r.target_url} ({r.target_pubkey}): {r.error}")
+            continue
+
+        print(f"\n🎉 SUCCESS! RMAP completed with target group")
+        print(f"\n📋 Summary:")
+        print(f"   - Your identity: {YOUR_IDENTITY}")
+        print(f"   - Target server: {r.target_url}")
+        print(f"   - Downloaded: {r.filename}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run an RMAP handshake against another group's server")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print the step-by-step handshake trace")
+    args = parser.parse_args()
+    logging.basicConfig(stream=sys.stdout, format="%(message)s")
+    log.setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+
     main()
\ No newline at end of file